@@ -8,6 +8,9 @@ try:
 except ImportError:
     yaml = None
 
+# C-загрузчик libyaml, если PyYAML собран с ним; иначе чистый Python
+YAML_LOADER = getattr(yaml, "CSafeLoader", None) or getattr(yaml, "SafeLoader", None)
+
 # Описание опкодов и ширины поля B
 OPCODES = {
     "CONST": {"A": 8,  "B_bits": 21, "arg": "value"},
@@ -17,38 +20,46 @@ OPCODES = {
 }
 
 
-def assemble_instruction(ins: dict) -> dict:
-
-    if "op" not in ins:
-        raise ValueError(f"Инструкция без поля 'op': {ins}")
-    op = ins["op"].upper()
-    if op not in OPCODES:
-        raise ValueError(f"Неизвестная команда: {op}")
-
-    meta = OPCODES[op]
+def _make_packer(op: str, meta: dict):
+    """Упаковщик для одного опкода: A, маска и имя аргумента посчитаны заранее."""
     A = meta["A"] & 0x1F          # 5 бит
     B_bits = meta["B_bits"]
     arg_name = meta["arg"]
 
     if B_bits == 0:
-        B = None
-    else:
+        return lambda ins: (None, A)
+
+    maxB = (1 << B_bits) - 1
+
+    def pack(ins: dict):
         if arg_name not in ins:
             raise ValueError(f"{op} требует аргумент '{arg_name}'")
         B = int(ins[arg_name])
-        maxB = (1 << B_bits) - 1
         if not (0 <= B <= maxB):
             raise ValueError(
                 f"{op}: значение поля B={B} не в диапазоне 0..{maxB}"
             )
+        # Упаковка: word = A | (B << 5), в 32 бита помещается всегда
+        return B, A | (B << 5)
+
+    return pack
 
-    # Упаковка: word = A | (B << 5)
-    value = A
-    if B is not None:
-        value |= (B << 5)
-    value &= 0xFFFFFFFF
 
-    return {"op": op, "A": A, "B": B, "word": value}
+# op -> pack(ins) -> (B, word)
+_PACKERS = {op: _make_packer(op, meta) for op, meta in OPCODES.items()}
+
+
+def assemble_instruction(ins: dict) -> dict:
+
+    if "op" not in ins:
+        raise ValueError(f"Инструкция без поля 'op': {ins}")
+    op = ins["op"].upper()
+    pack = _PACKERS.get(op)
+    if pack is None:
+        raise ValueError(f"Неизвестная команда: {op}")
+
+    B, value = pack(ins)
+    return {"op": op, "A": value & 0x1F, "B": B, "word": value}
 
 
 def assemble_program(src_path: str, out_path: str, test_mode: bool = False) -> None:
@@ -63,19 +74,19 @@ def assemble_program(src_path: str, out_path: str, test_mode: bool = False) -> N
     if not src.is_file():
         raise FileNotFoundError(f"Исходный файл не найден: {src_path}")
 
-    data = yaml.safe_load(src.read_text(encoding="utf-8"))
+    # Байты отдаём загрузчику напрямую: libyaml сам декодирует UTF-8
+    data = yaml.load(src.read_bytes(), Loader=YAML_LOADER)
     if not isinstance(data, list):
         raise ValueError("Файл программы YAML должен быть списком инструкций")
 
     ir = [assemble_instruction(ins) for ins in data]
 
     # Запись бинарника
-    out_file = pathlib.Path(out_path)
-    with out_file.open("wb") as f:
-        for item in ir:
-            f.write(struct.pack("<I", item["word"]))
-
-    size = out_file.stat().st_size
+    # Вся программа упаковывается одним вызовом (слова little-endian)
+    # и пишется в файл одной записью
+    payload = struct.Struct(f"<{len(ir)}I").pack(*(item["word"] for item in ir))
+    pathlib.Path(out_path).write_bytes(payload)
+    size = len(payload)
 
     # Всегда печатаем размер в байтах (требование этапа 2)
     print(f"Ассемблировано команд: {len(ir)}")
@@ -91,9 +102,8 @@ def assemble_program(src_path: str, out_path: str, test_mode: bool = False) -> N
                 print(f"{i:02d}: op={item['op']}, A={item['A']}, B={item['B']}")
 
         # И байты в hex, как в тестах спецификации
-        blob = out_file.read_bytes()
         print("\nБайты (hex):")
-        print(" ".join(f"0x{b:02X}," for b in blob).rstrip(","))
+        print(" ".join(f"0x{b:02X}," for b in payload).rstrip(","))
 
 
 def main(argv=None):
@@ -1,7 +1,8 @@
 import argparse
+import array
 import pathlib
 import struct
-import xml.etree.ElementTree as ET
+import sys
 
 
 # Карта A -> (name, B_bits)
@@ -11,56 +12,240 @@ LAYOUT = {
     28: ("STORE", 0),
     25: ("MAX",   13),
 }
+OP_CONST, OP_LOAD, OP_STORE, OP_MAX = 8, 21, 28, 25
+
+# Код типа array для беззнаковых 32-битных слов
+WORD_TYPECODE = "I" if array.array("I").itemsize == 4 else "L"
+
+# Глубина стека VM
+STACK_SIZE = 1024
+
+# Переход разреженной памяти (dict) в плотную (array uint32): после
+# DENSITY_SAMPLE записей проверяется доля занятых адресов в [min, max]
+DENSITY_SAMPLE = 256
+DENSE_MIN_DENSITY = 0.25
+DENSE_LIMIT = 1 << 20  # плотная память покрывает адреса 0..DENSE_LIMIT-1
+
+
+# Таблица декодирования, индексируемая A: (name, маска B, есть ли B) или None
+_DECODE = [None] * 32
+for _A, (_name, _B_bits) in LAYOUT.items():
+    _DECODE[_A] = (_name, (1 << _B_bits) - 1, _B_bits != 0)
 
 
 def decode_word(word: int):
     """Разобрать 32-битное слово на A, имя команды и B."""
     A = word & 0x1F  # 5 бит
-    if A not in LAYOUT:
+    entry = _DECODE[A]
+    if entry is None:
         raise ValueError(f"Неизвестный opcode A={A}")
-    name, B_bits = LAYOUT[A]
-    if B_bits:
-        B = (word >> 5) & ((1 << B_bits) - 1)
-    else:
-        B = None
+    name, mask, has_B = entry
+    B = (word >> 5) & mask if has_B else None
     return A, name, B
 
 
+def predecode(word: int):
+    """Разобрать слово в пару (A, B) для таблицы обработчиков VM.
+
+    Неизвестный opcode не считается ошибкой: она возникнет при исполнении.
+    """
+    A = word & 0x1F
+    entry = _DECODE[A]
+    if entry is None or not entry[2]:
+        return A, None
+    return A, (word >> 5) & entry[1]
+
+
+def compile_program(decoded: list, prog_len: int):
+    """
+    Сгенерировать Python-функцию, исполняющую программу с pc=0 и пустым стеком.
+
+    Переходов в ISA нет, поэтому каждая команда разворачивается в прямой код,
+    а стек целиком живёт в локальных переменных s0, s1, ...: глубина стека
+    в каждой точке известна заранее. Функция вызывается как fn(mem, patch)
+    и возвращает (pc, значения стека). Если дальше прямой код не годится —
+    нехватка или переполнение стека, неизвестный opcode, запись поверх ещё
+    не исполненного кода, — функция возвращает pc этой точки, и выполнение
+    продолжает обычный интерпретатор.
+    """
+    lines = ["def _program(mem, patch):", "    mem_get = mem.get"]
+    stack: list[str] = []  # литерал или имя s<i> для каждой ячейки стека
+    end = prog_len
+
+    for pc, (A, B) in enumerate(decoded):
+        if A == OP_CONST or A == OP_LOAD:
+            if len(stack) >= STACK_SIZE:
+                end = pc
+                break
+            if A == OP_CONST:
+                stack.append(str(B))
+            else:
+                name = f"s{len(stack)}"
+                lines.append(f"    {name} = mem_get({B}, 0)")
+                stack.append(name)
+
+        elif A == OP_STORE:
+            if len(stack) < 2:
+                end = pc
+                break
+            addr = stack.pop()
+            val = stack.pop()
+            lines.append(f"    mem[{addr}] = {val}")
+            if addr.isdigit():
+                if int(addr) < prog_len:
+                    lines.append(f"    patch({addr}, {val})")
+                    if int(addr) > pc:
+                        end = pc + 1
+                        break
+            else:
+                values = "".join(f"{e}, " for e in stack)
+                lines.append(f"    if {addr} < {prog_len}:")
+                lines.append(f"        patch({addr}, {val})")
+                lines.append(f"        if {addr} > {pc}:")
+                lines.append(f"            return {pc + 1}, ({values})")
+
+        elif A == OP_MAX:
+            if len(stack) < 2:
+                end = pc
+                break
+            base = stack.pop()
+            x = stack.pop()
+            addr = str(int(base) + B) if base.isdigit() else f"{base} + {B}"
+            name = f"s{len(stack)}"
+            lines.append(f"    y = mem_get({addr}, 0)")
+            lines.append(f"    {name} = {x} if {x} > y else y")
+            stack.append(name)
+
+        else:
+            end = pc
+            break
+
+    values = "".join(f"{e}, " for e in stack)
+    lines.append(f"    return {end}, ({values})")
+
+    namespace: dict = {}
+    exec("\n".join(lines), namespace)
+    return namespace["_program"]
+
+
 class VM:
     def __init__(self):
-        # Разреженная память: addr -> 32-битное значение
-        self.mem: dict[int, int] = {}
-        self.stack: list[int] = []
+        # Память: разреженная (dict addr -> 32-битное значение) или, если
+        # записи ложатся плотно, массив uint32 с индексом-адресом
+        self.mem: dict[int, int] | array.array = {}
+        self._dense: bool = False
+        self._stores_left: int = DENSITY_SAMPLE  # записей до проверки плотности
+        # Стек фиксированного размера из 32-битных слов; sp — число элементов
+        self.stack = array.array(WORD_TYPECODE, [0]) * STACK_SIZE
+        self.sp: int = 0
+        self.code = array.array(WORD_TYPECODE)  # слова программы подряд
+        self.decoded: list[tuple] = []          # (A, B) для каждого слова
         self.pc: int = 0        # program counter (в ячейках, не в байтах)
         self.prog_len: int = 0  # количество команд
+        self._compiled = None   # функция от compile_program, если собрана
+
+        # Таблица обработчиков, индексируемая opcode A (5 бит)
+        self._handlers = [None] * 32
+        for A, (name, _) in LAYOUT.items():
+            self._handlers[A] = getattr(self, f"_op_{name.lower()}")
 
     # ----- Работа с памятью -----
 
     def mem_get(self, addr: int) -> int:
         if addr < 0:
             raise IndexError("Отрицательный адрес памяти")
+        if self._dense:
+            return self.mem[addr] if addr < len(self.mem) else 0
         return self.mem.get(addr, 0)
 
     def mem_set(self, addr: int, value: int) -> None:
         if addr < 0:
             raise IndexError("Отрицательный адрес памяти")
-        self.mem[addr] = value & 0xFFFFFFFF
+        value &= 0xFFFFFFFF
+        if self._dense and addr >= len(self.mem):
+            self._grow_dense(addr)
+        self.mem[addr] = value
+        if addr < self.prog_len:
+            self._patch_code(addr, value)
+
+    def _maybe_densify(self) -> bool:
+        """Перейти на плотную память, если записанные адреса лежат кучно."""
+        mem = self.mem
+        lo, hi = min(mem), max(mem)
+        if hi >= DENSE_LIMIT or len(mem) / (hi - lo + 1) <= DENSE_MIN_DENSITY:
+            return False
+        dense = array.array(WORD_TYPECODE, [0]) * min(DENSE_LIMIT, hi + 1 + hi // 4)
+        for addr, value in mem.items():
+            dense[addr] = value
+        self.mem = dense
+        self._dense = True
+        return True
+
+    def _grow_dense(self, addr: int) -> None:
+        """Расширить плотную память до addr; за DENSE_LIMIT — вернуться к dict."""
+        mem = self.mem
+        if addr >= DENSE_LIMIT:
+            self.mem = {a: v for a, v in enumerate(mem) if v}
+            self._dense = False
+            return
+        size = min(DENSE_LIMIT, max(addr + 1, 2 * len(mem)))
+        mem.extend(array.array(WORD_TYPECODE, [0]) * (size - len(mem)))
+
+    def _patch_code(self, addr: int, value: int) -> None:
+        """Запись поверх кода: обновляем слово и его разобранную форму."""
+        self.code[addr] = value
+        self.decoded[addr] = predecode(value)
+        self._compiled = None
+
+    # ----- Работа со стеком -----
+
+    def _push(self, value: int) -> None:
+        if self.sp >= STACK_SIZE:
+            raise RuntimeError("Переполнение стека")
+        self.stack[self.sp] = value
+        self.sp += 1
+
+    def _pop(self) -> int:
+        self.sp -= 1
+        return self.stack[self.sp]
 
     # ----- Загрузка программы -----
 
     def load_program(self, path: str) -> None:
         """Читает бинарник, кладёт каждое 32-бит слово в mem[0..n-1]."""
-        blob = pathlib.Path(path).read_bytes()
-        if len(blob) % 4 != 0:
+        src = pathlib.Path(path)
+        size = src.stat().st_size
+        if size % 4 != 0:
             raise ValueError("Размер бинарного файла не кратен 4 байтам")
-        words = [
-            int.from_bytes(blob[i : i + 4], "little")
-            for i in range(0, len(blob), 4)
-        ]
-        for i, w in enumerate(words):
-            self.mem_set(i, w)
+        # Файл читается прямо в заранее выделенный массив слов через
+        # memoryview: без промежуточного bytes и без разбора по 4 байта
+        words = array.array(WORD_TYPECODE, [0]) * (size // 4)
+        with src.open("rb") as f:
+            if f.readinto(memoryview(words).cast("B")) != size:
+                raise ValueError("Бинарный файл изменился во время чтения")
+        if sys.byteorder != "little":
+            words.byteswap()
+        self.code = words
+        self.decoded = [predecode(w) for w in words]
+        if self._dense and len(words) > len(self.mem):
+            self._grow_dense(len(words) - 1)
+        if self._dense:
+            self.mem[:len(words)] = words
+        else:
+            self.mem.update(enumerate(words))
         self.prog_len = len(words)
         self.pc = 0
+        self._compiled = None
+
+    def compile(self) -> None:
+        """
+        Собрать программу в прямой Python-код (см. compile_program).
+
+        Сборка дороже однократной интерпретации: выигрыш есть, только если
+        программа затем исполняется многократно. run() использует собранную
+        функцию, когда стартует с pc=0 и пустым стеком.
+        """
+        self._compiled = compile_program(self.decoded, self.prog_len)
 
     # ----- Интерпретация -----
 
@@ -69,68 +254,164 @@ class VM:
         if self.pc >= self.prog_len:
             return False
 
-        word = self.mem_get(self.pc)
+        A, B = self.decoded[self.pc]
         self.pc += 1
 
-        A, name, B = decode_word(word)
-
-        if name == "CONST":
-            # push B
-            self.stack.append(B)
-
-        elif name == "LOAD":
-            # push mem[B]
-            val = self.mem_get(B)
-            self.stack.append(val)
-
-        elif name == "STORE":
-            # stack: [..., VALUE, ADDR]
-            if len(self.stack) < 2:
-                raise RuntimeError("STORE: недостаточно элементов в стеке")
-            addr = self.stack.pop()
-            val = self.stack.pop()
-            self.mem_set(addr, val)
-
-        elif name == "MAX":
-            # stack: [..., X, BASE]
-            if len(self.stack) < 2:
-                raise RuntimeError("MAX: недостаточно элементов в стеке")
-            base_addr = self.stack.pop()
-            x = self.stack.pop()
-            y = self.mem_get(base_addr + B)
-            self.stack.append(max(x, y))
-
-        else:
-            raise RuntimeError(f"Неизвестная команда: {name}")
-
+        handler = self._handlers[A]
+        if handler is None:
+            raise ValueError(f"Неизвестный opcode A={A}")
+        handler(B)
         return True
 
+    def _op_const(self, B: int) -> None:
+        # push B
+        self._push(B)
+
+    def _op_load(self, B: int) -> None:
+        # push mem[B]
+        self._push(self.mem_get(B))
+
+    def _op_store(self, B: None) -> None:
+        # stack: [..., VALUE, ADDR]
+        if self.sp < 2:
+            raise RuntimeError("STORE: недостаточно элементов в стеке")
+        addr = self._pop()
+        val = self._pop()
+        self.mem_set(addr, val)
+
+    def _op_max(self, B: int) -> None:
+        # stack: [..., X, BASE]
+        if self.sp < 2:
+            raise RuntimeError("MAX: недостаточно элементов в стеке")
+        base_addr = self._pop()
+        x = self._pop()
+        y = self.mem_get(base_addr + B)
+        self._push(x if x > y else y)
+
     def run(self, max_steps: int = 1_000_000) -> None:
         """Запускает программу до конца или до превышения лимита шагов."""
-        steps = 0
-        while self.pc < self.prog_len:
-            if steps >= max_steps:
-                raise RuntimeError("Превышен лимит шагов интерпретатора")
-            self.step()
-            steps += 1
+        # Переходов в ISA нет: pc растёт ровно на 1 за шаг, поэтому число
+        # шагов равно pc - start и отдельный счётчик в цикле не нужен.
+        start = self.pc
+        prog_len = self.prog_len
+        stop = min(prog_len, start + max(max_steps, 0))
+
+        if (self._compiled is not None and start == 0 and self.sp == 0
+                and stop == prog_len and not self._dense):
+            self.pc, values = self._compiled(self.mem, self._patch_code)
+            self.sp = len(values)
+            self.stack[:self.sp] = array.array(WORD_TYPECODE, values)
+            start = self.pc
+
+        decoded = self.decoded
+        # mem_get/mem_set раскрыты в цикле: адреса и значения на стеке
+        # всегда неотрицательны, проверка addr < 0 не нужна. При смене
+        # представления памяти локальные mem/dense/size перечитываются.
+        mem = self.mem
+        dense = self._dense
+        size = len(mem)
+        stores_left = self._stores_left
+
+        # Вершина стека держится в локальной переменной tos, в буфере лежит
+        # всё, что под ней: stack[0..sp-2]. При sp == 0 запись tos попадает
+        # в stack[-1] — последнюю ячейку, которая в этот момент свободна,
+        # поэтому проверка на пустой стек при push не нужна.
+        stack = self.stack
+        sp = self.sp
+        tos = stack[sp - 1] if sp else 0
+
+        pc = start
+        try:
+            for pc in range(start, stop):
+                A, B = decoded[pc]
+                if A == OP_CONST:
+                    if sp >= STACK_SIZE:
+                        raise RuntimeError("Переполнение стека")
+                    stack[sp - 1] = tos
+                    tos = B
+                    sp += 1
+                elif A == OP_LOAD:
+                    if sp >= STACK_SIZE:
+                        raise RuntimeError("Переполнение стека")
+                    stack[sp - 1] = tos
+                    if dense:
+                        tos = mem[B] if B < size else 0
+                    else:
+                        tos = mem.get(B, 0)
+                    sp += 1
+                elif A == OP_STORE:
+                    # stack: [..., VALUE, ADDR]
+                    if sp < 2:
+                        raise RuntimeError("STORE: недостаточно элементов в стеке")
+                    # Стек — массив uint32, маска 0xFFFFFFFF не нужна
+                    val = stack[sp - 2]
+                    if not dense:
+                        mem[tos] = val
+                        stores_left -= 1
+                        if stores_left == 0 and self._maybe_densify():
+                            mem, dense, size = self.mem, True, len(self.mem)
+                    elif tos < size:
+                        mem[tos] = val
+                    else:
+                        self._grow_dense(tos)
+                        mem, dense, size = self.mem, self._dense, len(self.mem)
+                        mem[tos] = val
+                    if tos < prog_len:
+                        self._patch_code(tos, val)
+                    tos = stack[sp - 3]
+                    sp -= 2
+                elif A == OP_MAX:
+                    # stack: [..., X, BASE]
+                    if sp < 2:
+                        raise RuntimeError("MAX: недостаточно элементов в стеке")
+                    addr = tos + B
+                    if dense:
+                        y = mem[addr] if addr < size else 0
+                    else:
+                        y = mem.get(addr, 0)
+                    x = stack[sp - 2]
+                    tos = x if x > y else y
+                    sp -= 1
+                else:
+                    raise ValueError(f"Неизвестный opcode A={A}")
+            pc = stop
+        except BaseException:
+            pc += 1
+            raise
+        finally:
+            self.pc = pc
+            self.sp = sp
+            self._stores_left = stores_left
+            if sp:
+                stack[sp - 1] = tos
+        if pc < prog_len:
+            raise RuntimeError("Превышен лимит шагов интерпретатора")
 
     # ----- Дамп памяти в XML -----
 
     def dump_xml(self, out_path: str, start: int, end: int) -> None:
         """
         Создаёт XML-дамп памяти с адресами [start, end).
-        """
-        root = ET.Element("memory")
-        root.set("start", str(start))
-        root.set("end", str(end))
 
-        for addr in range(start, end):
-            cell = ET.SubElement(root, "cell")
-            cell.set("addr", str(addr))
-            cell.set("value", str(self.mem_get(addr)))
+        В дамп попадают только ненулевые ячейки: каждая ячейка и так
+        подписана атрибутом addr, а пропущенные адреса равны 0.
+        Ячейки пишутся в файл по мере обхода, без построения дерева ElementTree.
+        """
+        mem = self.mem
+        if self._dense:
+            addrs = [a for a in range(max(start, 0), min(end, len(mem))) if mem[a]]
+        elif end - start <= len(mem):
+            addrs = [addr for addr in range(start, end) if mem.get(addr)]
+        else:
+            addrs = sorted(addr for addr, v in mem.items() if v and start <= addr < end)
 
-        tree = ET.ElementTree(root)
-        tree.write(out_path, encoding="utf-8", xml_declaration=True)
+        with open(out_path, "w", encoding="utf-8", newline="\n") as f:
+            f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+            f.write(f'<memory start="{start}" end="{end}">\n')
+            f.writelines(
+                f'  <cell addr="{addr}" value="{mem[addr]}"/>\n' for addr in addrs
+            )
+            f.write("</memory>\n")
 
 
 def main(argv=None):
@@ -149,10 +430,17 @@ def main(argv=None):
         default=64,
         help="Конечный адрес дампа (не включительно)",
     )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="Собрать программу в прямой Python-код перед запуском",
+    )
     args = parser.parse_args(argv)
 
     vm = VM()
     vm.load_program(args.program)
+    if args.compile:
+        vm.compile()
     vm.run()
     vm.dump_xml(args.dump, args.start, args.end)
 